@@ -249,12 +249,12 @@ class Molecule(object):
         """
         for states in self.states:
             states.energy = 0.
-            states.force = np.zeros((self.nat, self.ndim))
+            states.force.fill(0.)
 
         if (calc_coupling):
-            self.nacme = np.zeros((self.nst, self.nst))
+            self.nacme.fill(0.)
             if (not self.l_nacme):
-                self.nac = np.zeros((self.nst, self.nst, self.nat_qm, self.ndim))
+                self.nac.fill(0.)
 
     def backup_bo(self, calc_coupling):
         """ Backup BO energies and nonadiabatic couplings
@@ -265,9 +265,11 @@ class Molecule(object):
             states.energy_old = states.energy
 
         if (calc_coupling):
-            self.nacme_old = np.copy(self.nacme)
+            # Swap the current and old buffers instead of copying; the current
+            # buffer is refilled by reset_bo and the following QM calculation
+            self.nacme, self.nacme_old = self.nacme_old, self.nacme
             if (not self.l_nacme):
-                self.nac_old = np.copy(self.nac)
+                self.nac, self.nac_old = self.nac_old, self.nac
 
     def get_nr_electrons(self):
         """ Get the number of electrons
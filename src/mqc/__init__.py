@@ -2,5 +2,6 @@ from .bomd import BOMD
 from .eh import Eh
 from .ehxf import EhXF
 from .sh import SH
+from .sh_ensemble import run_ensemble
 from .shxf import SHXF
 from .ct import CT
@@ -27,10 +27,19 @@ def el_run(md):
         int ist, jst, nst, nesteps, verbosity
         double dt
 
+        double[:, ::1] nacme_mv
+        double[:, ::1] nacme_old_mv
+        double complex[:, ::1] rho_mv
+
     # Assign size variables
     nst = md.mol.nst
     nesteps, dt = md.nesteps, md.dt
 
+    # Typed views into the python arrays avoid per-element python indexing
+    nacme_mv = md.mol.nacme
+    nacme_old_mv = md.mol.nacme_old
+    rho_mv = md.mol.rho
+
     # Allocate variables
     energy = <double*> PyMem_Malloc(nst * sizeof(double))
     energy_old = <double*> PyMem_Malloc(nst * sizeof(double))
@@ -49,8 +58,8 @@ def el_run(md):
 
     for ist in range(nst):
         for jst in range(nst):
-            nacme[ist][jst] = md.mol.nacme[ist, jst]
-            nacme_old[ist][jst] = md.mol.nacme_old[ist, jst]
+            nacme[ist][jst] = nacme_mv[ist, jst]
+            nacme_old[ist][jst] = nacme_old_mv[ist, jst]
 
     # Debug related
     verbosity = md.verbosity
@@ -71,7 +80,7 @@ def el_run(md):
 
         for ist in range(nst):
             for jst in range(nst):
-                rho[ist][jst] = md.mol.rho[ist, jst]
+                rho[ist][jst] = rho_mv[ist, jst]
 
     py_bytes = md.elec_object.encode()
     elec_object_c = py_bytes
@@ -91,7 +100,7 @@ def el_run(md):
 
         for ist in range(nst):
             for jst in range(nst):
-                md.mol.rho[ist, jst] = np.conj(md.mol.states[ist].coef) * md.mol.states[jst].coef
+                rho_mv[ist, jst] = coef[ist].conjugate() * coef[jst]
 
         PyMem_Free(coef)
 
@@ -99,7 +108,7 @@ def el_run(md):
 
         for ist in range(nst):
             for jst in range(nst):
-                md.mol.rho[ist, jst] = rho[ist][jst]
+                rho_mv[ist, jst] = rho[ist][jst]
 
         for ist in range(nst):
             PyMem_Free(rho[ist])
@@ -111,7 +120,7 @@ def el_run(md):
             md.dotpopnac[ist] = 0.
             for jst in range(nst):
                 if (jst != ist):
-                    md.dotpopnac[ist] -= 2. * nacme[ist][jst] * md.mol.rho.real[jst, ist]
+                    md.dotpopnac[ist] -= 2. * nacme[ist][jst] * rho_mv[jst, ist].real
 
     # Deallocate variables
     for ist in range(nst):
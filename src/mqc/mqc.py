@@ -44,6 +44,10 @@ class MQC(object):
         self.istep = -1
         self.fstep = -1
 
+        # Per-state BO energies extracted once per step; dynamics that keep
+        # the cache current (SH) refresh it in update_energy
+        self._energies_cache = None
+
         # Decide unit of time step
         self.unit_dt = unit_dt.lower()
         if (self.unit_dt == 'au'):
@@ -440,8 +444,12 @@ class MQC(object):
         typewriter(tmp, unixmd_dir, "MOVIE.xyz", "a")
 
         # Write MDENERGY file including several energy information
+        energies = self._energies_cache
+        if (energies is None):
+            energies = np.fromiter((states.energy for states in self.mol.states), \
+                dtype=np.float64, count=self.mol.nst)
         tmp = f'{istep + 1:9d}{self.mol.ekin:15.8f}{self.mol.epot:15.8f}{self.mol.etot:15.8f}' \
-            + "".join([f'{states.energy:15.8f}' for states in self.mol.states])
+            + "".join(np.char.mod('%15.8f', energies))
         typewriter(tmp, unixmd_dir, "MDENERGY", "a")
 
         if (self.md_type != "BOMD"):
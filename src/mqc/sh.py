@@ -2,10 +2,60 @@ from __future__ import division
 from build.el_propagator import el_run
 from mqc.mqc import MQC
 from misc import eps, au_to_K, call_name, typewriter
-import random, os, shutil, textwrap
+from concurrent.futures import ThreadPoolExecutor
+import math, os, shutil, textwrap
 import numpy as np
 import pickle
 
+def _write_restart(restart_file, data):
+    """ Write serialized restart data atomically
+    """
+    tmp_file = restart_file + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, restart_file)
+
+def _rescale_energy(md, x, nac_pair):
+    """ Rescale velocities of QM atoms isotropically
+    """
+    md.mol.vel[0:md.mol.nat_qm] *= x
+
+def _rescale_velocity(md, x, nac_pair):
+    """ Shift velocities of QM atoms along the NACV
+    """
+    md.mol.vel[0:md.mol.nat_qm] += x * nac_pair
+
+def _rescale_momentum(md, x, nac_pair):
+    """ Shift momenta of QM atoms along the NACV
+    """
+    md.mol.vel[0:md.mol.nat_qm] += (x * md._inv_mass_col_qm) * nac_pair
+
+# Numba is an optional acceleration; the NumPy fallback is numerically
+# equivalent, though fastmath lets the compiled kernel reassociate the
+# arithmetic, so results may differ at machine precision
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+if (njit != None):
+    @njit(cache=True, fastmath=True)
+    def _hop_prob_kernel(rho_real, nacme, dt, rstate, prob):
+        """ Compiled kernel to fill the surface hopping probabilities
+        """
+        for ist in range(prob.shape[0]):
+            p = - 2. * rho_real[ist, rstate] * nacme[ist, rstate] * dt / rho_real[rstate, rstate]
+            if (ist == rstate or p < 0.):
+                p = 0.
+            prob[ist] = p
+else:
+    def _hop_prob_kernel(rho_real, nacme, dt, rstate, prob):
+        """ Vectorized kernel to fill the surface hopping probabilities
+        """
+        prob[:] = - 2. * rho_real[:, rstate] * nacme[:, rstate] * dt / rho_real[rstate, rstate]
+        prob[rstate] = 0.
+        np.maximum(prob, 0., out=prob)
+
 class SH(MQC):
     """ Class for surface hopping dynamics
 
@@ -25,14 +75,15 @@ class SH(MQC):
         :type init_coef: double, list or complex, list
         :param string dec_correction: Simple decoherence correction schemes
         :param double edc_parameter: Energy constant (H) for rescaling coefficients in edc
-        :param string unit_dt: Unit of time step 
+        :param integer seed: Seed of the random number generator used for hopping
+        :param string unit_dt: Unit of time step
         :param integer out_freq: Frequency of printing output
         :param integer verbosity: Verbosity of output
     """
     def __init__(self, molecule, thermostat=None, istate=0, dt=0.5, nsteps=1000, nesteps=20, \
         elec_object="density", propagator="rk4", l_print_dm=True, l_adj_nac=True, hop_rescale="augment", \
         hop_reject="reverse", init_coef=None, dec_correction=None, edc_parameter=0.1, \
-        unit_dt="fs", out_freq=1, verbosity=0):
+        seed=None, unit_dt="fs", out_freq=1, verbosity=0):
         # Initialize input values
         super().__init__(molecule, thermostat, istate, dt, nsteps, nesteps, \
             elec_object, propagator, l_print_dm, l_adj_nac, init_coef, unit_dt, out_freq, verbosity)
@@ -41,7 +92,13 @@ class SH(MQC):
         self.rstate = istate
         self.rstate_old = self.rstate
 
+        # Cache mass arrays used in velocity rescaling; masses do not change during dynamics
+        self._mass_qm = self.mol.mass[0:self.mol.nat_qm]
+        self._inv_mass_qm = 1. / self._mass_qm
+        self._inv_mass_col_qm = self._inv_mass_qm.reshape((-1, 1))
+
         self.rand = 0.
+        self._rng = np.random.default_rng(seed)
         self.prob = np.zeros(self.mol.nst)
         self.acc_prob = np.zeros(self.mol.nst + 1)
 
@@ -54,6 +111,12 @@ class SH(MQC):
             error_vars = f"hop_rescale = {self.hop_rescale}"
             raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
+        # Bind the velocity update routine once; the augment method applies the
+        # momentum-type update and only falls back to isotropic rescaling in
+        # evaluate_hop when no solution for the scaling factor exists
+        self._rescale_fn = {"energy": _rescale_energy, "velocity": _rescale_velocity, \
+            "momentum": _rescale_momentum, "augment": _rescale_momentum}[self.hop_rescale]
+
         self.hop_reject = hop_reject.lower()
         if not (self.hop_reject in ["keep", "reverse"]):
             error_message = "Invalid rescaling method for frustrated hop!"
@@ -88,6 +151,10 @@ class SH(MQC):
         # Debug variables
         self.dotpopnac = np.zeros(self.mol.nst)
 
+        # Per-step output files kept open during run; see write_sh
+        self._fh_shstate = None
+        self._fh_shprob = None
+
         # Initialize event to print
         self.event = {"HOP": []}
 
@@ -109,6 +176,7 @@ class SH(MQC):
         qm.calc_coupling = True
         qm.calc_tdp = False
         qm.calc_tdp_grad = False
+        l_do_mm = (self.mol.l_qmmm and mm != None)
         self.print_init(qm, mm, restart)
 
         if (restart == None):
@@ -116,7 +184,7 @@ class SH(MQC):
             self.istep = -1
             self.mol.reset_bo(qm.calc_coupling)
             qm.get_data(self.mol, base_dir, bo_list, self.dt, self.istep, calc_force_only=False)
-            if (self.mol.l_qmmm and mm != None):
+            if (l_do_mm):
                 mm.get_data(self.mol, base_dir, bo_list, self.istep, calc_force_only=False)
             if (not self.mol.l_nacme):
                 self.mol.get_nacme()
@@ -136,7 +204,7 @@ class SH(MQC):
             if (self.l_hop):
                 if (qm.re_calc):
                     qm.get_data(self.mol, base_dir, bo_list, self.dt, self.istep, calc_force_only=True)
-                if (self.mol.l_qmmm and mm != None):
+                if (l_do_mm):
                     mm.get_data(self.mol, base_dir, bo_list, self.istep, calc_force_only=True)
 
             self.update_energy()
@@ -156,6 +224,10 @@ class SH(MQC):
 
         self.istep += 1
 
+        restart_file = os.path.join(base_dir, "RESTART.bin")
+        restart_pool = ThreadPoolExecutor(max_workers=1)
+        restart_future = None
+
         # Main MD loop
         for istep in range(self.istep, self.nsteps):
 
@@ -165,7 +237,7 @@ class SH(MQC):
             self.mol.backup_bo(qm.calc_coupling)
             self.mol.reset_bo(qm.calc_coupling)
             qm.get_data(self.mol, base_dir, bo_list, self.dt, istep, calc_force_only=False)
-            if (self.mol.l_qmmm and mm != None):
+            if (l_do_mm):
                 mm.get_data(self.mol, base_dir, bo_list, istep, calc_force_only=False)
 
             if (not self.mol.l_nacme and self.l_adj_nac):
@@ -194,7 +266,7 @@ class SH(MQC):
             if (self.l_hop):
                 if (qm.re_calc):
                     qm.get_data(self.mol, base_dir, bo_list, self.dt, istep, calc_force_only=True)
-                if (self.mol.l_qmmm and mm != None):
+                if (l_do_mm):
                     mm.get_data(self.mol, base_dir, bo_list, istep, calc_force_only=True)
 
             if (self.thermo != None):
@@ -210,9 +282,25 @@ class SH(MQC):
                 self.write_final_xyz(unixmd_dir, istep)
 
             self.fstep = istep
-            restart_file = os.path.join(base_dir, "RESTART.bin")
-            with open(restart_file, 'wb') as f:
-                pickle.dump({'qm':qm, 'md':self}, f)
+            if ((istep + 1) % self.out_freq == 0 or istep == self.nsteps - 1):
+                # Serialize in the main thread for a consistent snapshot; the
+                # background worker writes the restart file atomically. Check
+                # the previous write so a failure is not silently discarded
+                if (restart_future != None):
+                    restart_future.result()
+                data = pickle.dumps({'qm':qm, 'md':self})
+                restart_future = restart_pool.submit(_write_restart, restart_file, data)
+
+        if (restart_future != None):
+            restart_future.result()
+        restart_pool.shutdown(wait=True)
+
+        # Flush and close per-step output files
+        if (self._fh_shstate != None):
+            self._fh_shstate.close()
+            self._fh_shprob.close()
+            self._fh_shstate = None
+            self._fh_shprob = None
 
         # Delete scratch directory
         if (not l_save_scr):
@@ -220,7 +308,7 @@ class SH(MQC):
             if (os.path.exists(tmp_dir)):
                 shutil.rmtree(tmp_dir)
 
-            if (self.mol.l_qmmm and mm != None):
+            if (l_do_mm):
                 tmp_dir = os.path.join(unixmd_dir, "scr_mm")
                 if (os.path.exists(tmp_dir)):
                     shutil.rmtree(tmp_dir)
@@ -233,22 +321,14 @@ class SH(MQC):
         # Reset surface hopping variables
         self.rstate_old = self.rstate
 
-        self.prob = np.zeros(self.mol.nst)
-        self.acc_prob = np.zeros(self.mol.nst + 1)
-
         self.l_hop = False
 
-        accum = 0.
-
-        for ist in range(self.mol.nst):
-            if (ist != self.rstate):
-                self.prob[ist] = - 2. * self.mol.rho.real[ist, self.rstate] * \
-                    self.mol.nacme[ist, self.rstate] * self.dt / self.mol.rho.real[self.rstate, self.rstate]
+        # Calculate hopping probabilities for all states at once; prob and
+        # acc_prob[1:] are overwritten in full, and acc_prob[0] stays zero,
+        # so the buffers allocated in __init__ are reused without reallocation
+        _hop_prob_kernel(self.mol.rho.real, self.mol.nacme, self.dt, self.rstate, self.prob)
 
-                if (self.prob[ist] < 0.):
-                    self.prob[ist] = 0.
-                accum += self.prob[ist]
-            self.acc_prob[ist + 1] = accum
+        self.acc_prob[1:] = np.cumsum(self.prob)
         psum = self.acc_prob[self.mol.nst]
 
         if (psum > 1.):
@@ -260,14 +340,15 @@ class SH(MQC):
 
             :param integer,list bo_list: List of BO states for BO calculation
         """
-        self.rand = random.random()
-        for ist in range(self.mol.nst):
-            if (ist == self.rstate):
-                continue
-            if (self.rand > self.acc_prob[ist] and self.rand <= self.acc_prob[ist + 1]):
-                self.l_hop = True
-                self.rstate = ist
-                bo_list[0] = self.rstate
+        self.rand = float(self._rng.random())
+        # Since acc_prob is monotonically non-decreasing, the hopping state is found
+        # with a single binary search; acc_prob[ist] < rand <= acc_prob[ist + 1]
+        # The interval for the running state has zero width, hence it is never chosen
+        ist = int(np.searchsorted(self.acc_prob, self.rand, side="left")) - 1
+        if (0 <= ist < self.mol.nst and ist != self.rstate and self.acc_prob[ist + 1] > self.acc_prob[ist]):
+            self.l_hop = True
+            self.rstate = ist
+            bo_list[0] = self.rstate
 
     def evaluate_hop(self, bo_list):
         """ Routine to evaluate hopping and velocity rescaling
@@ -283,20 +364,19 @@ class SH(MQC):
             a = 1.
             b = 1.
             det = 1.
-            if (self.hop_rescale == "velocity"):
-                a = np.sum(self.mol.mass[0:self.mol.nat_qm] * np.sum(self.mol.nac[self.rstate_old, self.rstate] ** 2., axis=1))
-                b = 2. * np.sum(self.mol.mass[0:self.mol.nat_qm] * np.sum(self.mol.nac[self.rstate_old, self.rstate] \
-                    * self.mol.vel[0:self.mol.nat_qm], axis=1))
-                c = 2. * pot_diff
-                det = b ** 2. - 4. * a * c
-            elif (self.hop_rescale == "momentum"):
-                a = np.sum(1. / self.mol.mass[0:self.mol.nat_qm] * np.sum(self.mol.nac[self.rstate_old, self.rstate] ** 2., axis=1))
-                b = 2. * np.sum(np.sum(self.mol.nac[self.rstate_old, self.rstate] * self.mol.vel[0:self.mol.nat_qm], axis=1))
-                c = 2. * pot_diff
-                det = b ** 2. - 4. * a * c
-            elif (self.hop_rescale == "augment"):
-                a = np.sum(1. / self.mol.mass[0:self.mol.nat_qm] * np.sum(self.mol.nac[self.rstate_old, self.rstate] ** 2., axis=1))
-                b = 2. * np.sum(np.sum(self.mol.nac[self.rstate_old, self.rstate] * self.mol.vel[0:self.mol.nat_qm], axis=1))
+            nac_pair = None
+            if (self.hop_rescale in ["velocity", "momentum", "augment"]):
+                # The reductions over the coupling vector are common to all methods;
+                # compute them once and let each branch pick the mass weighting
+                nac_pair = self.mol.nac[self.rstate_old, self.rstate]
+                nac2_per_atom = np.einsum('ij,ij->i', nac_pair, nac_pair)
+                nacv_per_atom = np.einsum('ij,ij->i', nac_pair, self.mol.vel[0:self.mol.nat_qm])
+                if (self.hop_rescale == "velocity"):
+                    a = np.dot(self._mass_qm, nac2_per_atom)
+                    b = 2. * np.dot(self._mass_qm, nacv_per_atom)
+                else:
+                    a = np.dot(self._inv_mass_qm, nac2_per_atom)
+                    b = 2. * np.sum(nacv_per_atom)
                 c = 2. * pot_diff
                 det = b ** 2. - 4. * a * c
 
@@ -331,38 +411,31 @@ class SH(MQC):
                 self.l_hop = False
                 self.rstate = self.rstate_old
                 bo_list[0] = self.rstate
+                if (self.hop_rescale in ["velocity", "momentum", "augment"]):
+                    # Re-bind the coupling pair for the restored running state
+                    nac_pair = self.mol.nac[self.rstate_old, self.rstate]
             else:
                 if (self.hop_rescale == "energy" or (det < 0. and self.hop_rescale == "augment")):
                     if (det < 0.):
                         self.event["HOP"].append("Accept hopping: no solution to find rescale factor, but velocity is simply rescaled")
-                    x = np.sqrt(1. - pot_diff / self.mol.ekin_qm)
+                    x = math.sqrt(1. - pot_diff / self.mol.ekin_qm)
                 else:
                     if (b < 0.):
-                        x = 0.5 * (- b - np.sqrt(det)) / a
+                        x = 0.5 * (- b - math.sqrt(det)) / a
                     else:
-                        x = 0.5 * (- b + np.sqrt(det)) / a
+                        x = 0.5 * (- b + math.sqrt(det)) / a
 
             # Rescale velocities for QM atoms
             if (not (self.hop_reject == "keep" and self.l_reject)):
-                if (self.hop_rescale == "energy"):
-                    self.mol.vel[0:self.mol.nat_qm] *= x
-
-                elif (self.hop_rescale == "velocity"):
-                    self.mol.vel[0:self.mol.nat_qm] += x * self.mol.nac[self.rstate_old, self.rstate]
-
-                elif (self.hop_rescale == "momentum"):
-                    self.mol.vel[0:self.mol.nat_qm] += x * self.mol.nac[self.rstate_old, self.rstate] / \
-                        self.mol.mass[0:self.mol.nat_qm].reshape((-1, 1))
-
-                elif (self.hop_rescale == "augment"):
-                    if (det > 0. or self.mol.ekin_qm < pot_diff):
-                        self.mol.vel[0:self.mol.nat_qm] += x * self.mol.nac[self.rstate_old, self.rstate] / \
-                            self.mol.mass[0:self.mol.nat_qm].reshape((-1, 1))
-                    else:
-                        self.mol.vel[0:self.mol.nat_qm] *= x
+                if (self.hop_rescale == "augment" and not (det > 0. or self.mol.ekin_qm < pot_diff)):
+                    _rescale_energy(self, x, nac_pair)
+                else:
+                    self._rescale_fn(self, x, nac_pair)
 
-            # Update kinetic energy
-            self.mol.update_kinetic()
+            # Update kinetic energy only when it is read again before
+            # update_energy recomputes it in the MD loop
+            if (self.dec_correction == "edc" or self.thermo != None):
+                self.mol.update_kinetic()
 
         # Record hopping event
         if (self.rstate != self.rstate_old):
@@ -425,14 +498,18 @@ class SH(MQC):
     def calculate_force(self):
         """ Routine to calculate the forces
         """
-        self.rforce = np.copy(self.mol.states[self.rstate].force)
+        np.copyto(self.rforce, self.mol.states[self.rstate].force)
 
     def update_energy(self):
         """ Routine to update the energy of molecules in surface hopping dynamics
         """
         # Update kinetic energy
         self.mol.update_kinetic()
-        self.mol.epot = self.mol.states[self.rstate].energy
+        # Extract the BO energies in one pass over the states list; the array
+        # is kept for the output writers called in the same step
+        self._energies_cache = np.fromiter((states.energy for states in self.mol.states), \
+            dtype=np.float64, count=self.mol.nst)
+        self.mol.epot = self._energies_cache[self.rstate]
         self.mol.etot = self.mol.epot + self.mol.ekin
 
     def write_md_output(self, unixmd_dir, istep):
@@ -456,13 +533,20 @@ class SH(MQC):
             :param string unixmd_dir: PyUNIxMD directory
             :param integer istep: Current MD step
         """
+        # Keep the files open across steps instead of reopening them per write
+        if (self._fh_shstate == None):
+            self._fh_shstate = open(os.path.join(unixmd_dir, "SHSTATE"), "a")
+            self._fh_shprob = open(os.path.join(unixmd_dir, "SHPROB"), "a")
+
         # Write SHSTATE file
-        tmp = f'{istep + 1:9d}{"":14s}{self.rstate}'
-        typewriter(tmp, unixmd_dir, "SHSTATE", "a")
+        self._fh_shstate.write(f'{istep + 1:9d}{"":14s}{self.rstate}\n')
 
         # Write SHPROB file
-        tmp = f'{istep + 1:9d}' + "".join([f'{self.prob[ist]:15.8f}' for ist in range(self.mol.nst)])
-        typewriter(tmp, unixmd_dir, "SHPROB", "a")
+        self._fh_shprob.write(f'{istep + 1:9d}' + "".join([f'{self.prob[ist]:15.8f}' for ist in range(self.mol.nst)]) + "\n")
+
+        # Flush on the output cadence so the files never lag the checkpoint
+        self._fh_shstate.flush()
+        self._fh_shprob.flush()
 
     def write_dotpop(self, unixmd_dir, istep):
         """ Write time-derivative BO population
@@ -475,6 +559,14 @@ class SH(MQC):
             tmp = f'{istep + 1:9d}' + "".join([f'{pop:15.8f}' for pop in self.dotpopnac])
             typewriter(tmp, unixmd_dir, "DOTPOPNAC", "a")
 
+    def __getstate__(self):
+        """ Exclude open file handles when the object is pickled for restart
+        """
+        state = self.__dict__.copy()
+        state["_fh_shstate"] = None
+        state["_fh_shprob"] = None
+        return state
+
     def print_init(self, qm, mm, restart):
         """ Routine to print the initial information of dynamics
 
@@ -510,9 +602,7 @@ class SH(MQC):
             :param integer istep: Current MD step
         """
         ctemp = self.mol.ekin * 2. / float(self.mol.ndof) * au_to_K
-        norm = 0.
-        for ist in range(self.mol.nst):
-            norm += self.mol.rho.real[ist, ist]
+        norm = float(np.trace(self.mol.rho.real))
 
         # Print INFO for each step
         INFO = f" INFO{istep + 1:>9d}{self.rstate:>5d}"
@@ -523,10 +613,8 @@ class SH(MQC):
 
         # Print DEBUG1 for each step
         if (self.verbosity >= 1):
-            DEBUG1 = f" DEBUG1{istep + 1:>7d}"
-            DEBUG1 += f"{self.rand:11.5f}"
-            for ist in range(self.mol.nst):
-                DEBUG1 += f"{self.acc_prob[ist]:12.5f} ({self.rstate}->{ist})"
+            DEBUG1 = f" DEBUG1{istep + 1:>7d}{self.rand:11.5f}" + \
+                "".join(f"{self.acc_prob[ist]:12.5f} ({self.rstate}->{ist})" for ist in range(self.mol.nst))
             print (DEBUG1, flush=True)
 
         # Print event in surface hopping
@@ -0,0 +1,60 @@
+from __future__ import division
+from misc import call_name
+import multiprocessing, random
+import numpy as np
+
+def _run_single(args):
+    """ Worker routine to run one independent trajectory
+
+        :param tuple args: Trajectory index, MD factory, QM factory, output directory, seed sequence and run options
+    """
+    itraj, md_factory, qm_factory, output_dir, seed_seq, run_kwargs = args
+
+    # Decorrelate the random number sequences between workers; hop_check draws
+    # from a per-instance NumPy generator, which is reseeded from the spawned
+    # sequence so identical factories still give independent trajectories
+    random.seed(int(seed_seq.generate_state(1)[0]))
+    md = md_factory()
+    if (hasattr(md, "_rng")):
+        md._rng = np.random.default_rng(seed_seq)
+    qm = qm_factory()
+    md.run(qm, output_dir=output_dir, **run_kwargs)
+
+    return itraj
+
+def run_ensemble(md_factories, qm_factory, n_workers=None, output_dirs=None, seed=None, **run_kwargs):
+    """ Run an ensemble of independent trajectories in parallel
+
+        Each trajectory is embarrassingly parallel, so the workers construct
+        their own MD and QM objects from the given factories and call the
+        usual run method in a separate output directory. The factories must
+        be picklable (module-level functions or functools.partial objects).
+
+        :param md_factories: List of callables, each returning a fresh MD object
+        :type md_factories: callable, list
+        :param callable qm_factory: Callable returning a fresh QM object
+        :param integer n_workers: Number of worker processes (None uses all cores)
+        :param output_dirs: Names of directories where outputs to be saved
+        :type output_dirs: string, list
+        :param integer seed: Seed of the per-trajectory random number sequences
+        :param run_kwargs: Additional keyword arguments passed to each run call
+    """
+    ntraj = len(md_factories)
+
+    if (output_dirs == None):
+        ndigit = len(str(ntraj))
+        output_dirs = [f"./TRAJ_{itraj + 1:0{ndigit}d}" for itraj in range(ntraj)]
+
+    if (len(output_dirs) != ntraj):
+        error_message = "Number of output directories does not match number of trajectories!"
+        error_vars = f"len(md_factories) = {ntraj}, len(output_dirs) = {len(output_dirs)}"
+        raise ValueError (f"( {call_name()} ) {error_message} ( {error_vars} )")
+
+    # Spawn statistically independent child sequences for the workers
+    seed_seqs = np.random.SeedSequence(seed).spawn(ntraj)
+
+    args = [(itraj, md_factories[itraj], qm_factory, output_dirs[itraj], seed_seqs[itraj], run_kwargs) \
+        for itraj in range(ntraj)]
+
+    with multiprocessing.Pool(processes=n_workers) as pool:
+        pool.map(_run_single, args)
@@ -1,10 +1,18 @@
 from __future__ import division
 from mqc_qed.mqc import MQC_QED
 from misc import au_to_K, call_name
-import os, shutil, textwrap
+import os, shutil, sys, textwrap
 import numpy as np
 import pickle
 
+# Static part of the dynamics header printed once per run
+_DYNAMICS_HEADER = textwrap.dedent(f"""\
+
+{"-" * 118}
+{"Start Dynamics":>65s}
+{"-" * 118}
+""") + f" #INFO{'STEP':>8s}{'State':>7s}{'Kinetic(H)':>13s}{'Potential(H)':>15s}{'Total(H)':>13s}{'Temperature(K)':>17s}"
+
 class BOMD(MQC_QED):
     """ Class for born-oppenheimer molecular dynamics (BOMD) coupled to confined cavity mode
 
@@ -16,14 +24,23 @@ class BOMD(MQC_QED):
         :param boolean l_adj_tdp: Adjust transition dipole moments to align the phases
         :param string unit_dt: Unit of time step
         :param integer out_freq: Frequency of printing output
+        :param integer restart_freq: Frequency of writing the restart file
         :param integer verbosity: Verbosity of output
     """
     def __init__(self, polariton, thermostat=None, istate=0, dt=0.5, nsteps=1000, l_adj_tdp=True, \
-        unit_dt="fs", out_freq=1, verbosity=0):
+        unit_dt="fs", out_freq=1, restart_freq=None, verbosity=0):
         # Initialize input values
         super().__init__(polariton, thermostat, istate, dt, nsteps, None, None, None, \
             False, None, l_adj_tdp, None, unit_dt, out_freq, verbosity)
 
+        # Initialize restart checkpoint interval
+        self.restart_freq = restart_freq
+        if (self.restart_freq == None):
+            self.restart_freq = self.out_freq
+
+        # Precompiled INFO format reused in every print_step call
+        self._info_fmt = " INFO{:9d}{:5d} {:14.8f}{:15.8f}{:15.8f}{:13.6f}\n".format
+
     def run(self, qed, qm, mm=None, output_dir="./", l_save_qed_log=False, l_save_qm_log=False, \
         l_save_mm_log=False, l_save_scr=True, restart=None):
         """ Run MQC dynamics according to BOMD
@@ -50,6 +67,7 @@ class BOMD(MQC_QED):
         qm.calc_tdp_grad = False
         if (qed.force_level == "full"):
             qm.calc_tdp_grad = True
+        l_do_mm = (self.pol.l_qmmm and mm != None)
         self.print_init(qed, qm, mm, restart)
 
         if (restart == None):
@@ -57,8 +75,9 @@ class BOMD(MQC_QED):
             self.istep = -1
             self.pol.reset_bo(qm.calc_coupling)
             qm.get_data(self.pol, base_dir, bo_list, self.dt, self.istep, calc_force_only=False)
-            if (self.pol.l_qmmm and mm != None):
+            if (l_do_mm):
                 mm.get_data(self.pol, base_dir, bo_list, self.istep, calc_force_only=False)
+            self.pol.update_kinetic()
             self.update_energy()
             self.write_md_output(unixmd_dir, self.istep)
             self.print_step(self.istep)
@@ -75,6 +94,8 @@ class BOMD(MQC_QED):
 
         self.istep += 1
 
+        restart_file = os.path.join(base_dir, "RESTART.bin")
+
         # Main MD loop
         for istep in range(self.istep, self.nsteps):
 
@@ -83,7 +104,10 @@ class BOMD(MQC_QED):
 
             self.pol.reset_bo(qm.calc_coupling)
             qm.get_data(self.pol, base_dir, bo_list, self.dt, istep, calc_force_only=False)
-            if (self.pol.l_qmmm and mm != None):
+            # The MM part cannot overlap with the QM call: the MM interfaces
+            # accumulate their energies and forces onto the state data the QM
+            # calculation writes first
+            if (l_do_mm):
                 mm.get_data(self.pol, base_dir, bo_list, istep, calc_force_only=False)
 
             self.calculate_force()
@@ -101,33 +125,36 @@ class BOMD(MQC_QED):
                 self.write_final_xyz(unixmd_dir, istep)
 
             self.fstep = istep
-            restart_file = os.path.join(base_dir, "RESTART.bin")
-            with open(restart_file, 'wb') as f:
-                pickle.dump({'qm':qm, 'md':self}, f)
-
-        # Delete scratch directory
+            if ((istep + 1) % self.restart_freq == 0 or istep == self.nsteps - 1):
+                # Write to a temporary file first so that an interrupted run
+                # never leaves a truncated restart file behind; the layout
+                # matches the documented restart recipe
+                tmp_file = restart_file + ".tmp"
+                with open(tmp_file, 'wb') as f:
+                    pickle.dump({'qm':qm, 'md':self}, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_file, restart_file)
+
+        # Delete scratch directory; ignore_errors covers missing directories
         if (not l_save_scr):
-            tmp_dir = os.path.join(unixmd_dir, "scr_qm")
-            if (os.path.exists(tmp_dir)):
-                shutil.rmtree(tmp_dir)
-
-            if (self.pol.l_qmmm and mm != None):
-                tmp_dir = os.path.join(unixmd_dir, "scr_mm")
-                if (os.path.exists(tmp_dir)):
-                    shutil.rmtree(tmp_dir)
+            scr_dirs = ["scr_qm"]
+            if (l_do_mm):
+                scr_dirs.append("scr_mm")
+            for scr_dir in scr_dirs:
+                shutil.rmtree(os.path.join(unixmd_dir, scr_dir), ignore_errors=True)
 
     def calculate_force(self):
         """ Routine to calculate the forces
         """
-        self.rforce = np.copy(self.mol.states[self.istate].force)
+        np.copyto(self.rforce, self.pol.pol_states[self.istate].force)
 
     def update_energy(self):
         """ Routine to update the energy of molecules in BOMD
         """
-        # Update kinetic energy
-        self.mol.update_kinetic()
-        self.mol.epot = self.mol.states[self.istate].energy
-        self.mol.etot = self.mol.epot + self.mol.ekin
+        # Kinetic energy is already updated in cl_update_velocity; the initial
+        # step updates it explicitly before calling this routine
+        pol = self.pol
+        pol.epot = pol.pol_states[self.istate].energy
+        pol.etot = pol.epot + pol.ekin
 
     def print_init(self, qed, qm, mm, restart):
         """ Routine to print the initial information of dynamics
@@ -140,31 +167,19 @@ class BOMD(MQC_QED):
         # Print initial information about polariton, qed, qm, mm and thermostat
         super().print_init(qed, qm, mm, restart)
 
-        # Print dynamics information for start line
-        dynamics_step_info = textwrap.dedent(f"""\
-
-        {"-" * 118}
-        {"Start Dynamics":>65s}
-        {"-" * 118}
-        """)
-
-        # Print INIT for each step
-        INIT = f" #INFO{'STEP':>8s}{'State':>7s}{'Kinetic(H)':>13s}{'Potential(H)':>15s}{'Total(H)':>13s}{'Temperature(K)':>17s}"
-        dynamics_step_info += INIT
-
-        print (dynamics_step_info, flush=True)
+        # Print dynamics information and INIT header for each step
+        print (_DYNAMICS_HEADER, flush=True)
 
     def print_step(self, istep):
         """ Routine to print each steps information about dynamics
 
             :param integer istep: Current MD step
         """
-        ctemp = self.mol.ekin * 2. / float(self.mol.ndof) * au_to_K
+        ctemp = self.pol.ekin * 2. / float(self.pol.ndof) * au_to_K
 
-        # Print INFO for each step
-        INFO = f" INFO{istep + 1:>9d}{self.istate:>5d} "
-        INFO += f"{self.mol.ekin:14.8f}{self.mol.epot:15.8f}{self.mol.etot:15.8f}"
-        INFO += f"{ctemp:13.6f}"
-        print (INFO, flush=True)
+        # Print INFO for each step with a single write call
+        sys.stdout.write(self._info_fmt(istep + 1, self.istate, \
+            self.pol.ekin, self.pol.epot, self.pol.etot, ctemp))
+        sys.stdout.flush()
 
 
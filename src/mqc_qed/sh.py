@@ -1,11 +1,48 @@
 from __future__ import division
 from build_qed.el_propagator import el_run
 from mqc_qed.mqc import MQC_QED
-from misc import eps, au_to_K, call_name, typewriter
-import random, os, shutil, textwrap
+from misc import eps, au_to_K, call_name
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import math, random, os, shutil, textwrap
 import numpy as np
 import pickle
 
+def _write_restart(restart_file, data):
+    """ Write serialized restart data atomically
+    """
+    tmp_file = restart_file + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, restart_file)
+
+# Numba is an optional acceleration; the NumPy fallback is numerically
+# equivalent, though fastmath lets the compiled kernel reassociate the
+# arithmetic, so results may differ at machine precision
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+if (njit != None):
+    @njit(cache=True, fastmath=True)
+    def _hop_prob_kernel(rho_re_row, rho_im_row, ham_row, pnacme_row, dt, rstate, prob):
+        """ Compiled kernel to fill the surface hopping probabilities
+        """
+        for ist in range(prob.shape[0]):
+            p = - 2. * (rho_im_row[ist] * ham_row[ist] - rho_re_row[ist] * pnacme_row[ist]) \
+                * dt / rho_re_row[rstate]
+            if (ist == rstate or p < 0.):
+                p = 0.
+            prob[ist] = p
+else:
+    def _hop_prob_kernel(rho_re_row, rho_im_row, ham_row, pnacme_row, dt, rstate, prob):
+        """ Vectorized kernel to fill the surface hopping probabilities
+        """
+        prob[:] = - 2. * (rho_im_row * ham_row - rho_re_row * pnacme_row) * dt / rho_re_row[rstate]
+        prob[rstate] = 0.
+        np.maximum(prob, 0., out=prob)
+
 class SH(MQC_QED):
     """ Class for surface hopping dynamics coupled to confined cavity mode
 
@@ -26,18 +63,24 @@ class SH(MQC_QED):
         :type init_coef: double, list or complex, list
         :param string dec_correction: Simple decoherence correction schemes
         :param double edc_parameter: Energy constant (H) for rescaling coefficients in edc
-        :param string unit_dt: Unit of time step 
+        :param string unit_dt: Unit of time step
         :param integer out_freq: Frequency of printing output
+        :param integer restart_freq: Frequency of writing the restart file
         :param integer verbosity: Verbosity of output
     """
     def __init__(self, polariton, thermostat=None, istate=0, dt=0.5, nsteps=1000, nesteps=20, \
         elec_object="density", propagator="rk4", l_print_dm=True, l_adj_nac=True, l_adj_tdp=True, \
         hop_rescale="augment", hop_reject="reverse", init_coef=None, dec_correction=None, \
-        edc_parameter=0.1, unit_dt="fs", out_freq=1, verbosity=0):
+        edc_parameter=0.1, unit_dt="fs", out_freq=1, restart_freq=None, verbosity=0):
         # Initialize input values
         super().__init__(polariton, thermostat, istate, dt, nsteps, nesteps, elec_object, \
             propagator, l_print_dm, l_adj_nac, l_adj_tdp, init_coef, unit_dt, out_freq, verbosity)
 
+        # Initialize restart checkpoint interval
+        self.restart_freq = restart_freq
+        if (self.restart_freq == None):
+            self.restart_freq = self.out_freq
+
         # Initialize SH variables
         self.rstate = istate
         self.rstate_old = self.rstate
@@ -85,11 +128,32 @@ class SH(MQC_QED):
                 error_vars = f"hop_reject = {self.hop_reject}"
                 raise ValueError (f"( {self.md_type}.{call_name()} ) {error_message} ( {error_vars} )")
 
+        # Cached mass views for the QM atoms used in velocity rescaling
+        self._mass_qm = self.pol.mass[0:self.pol.nat_qm]
+        self._inv_mass_qm = 1. / self._mass_qm
+        self._inv_mass_col_qm = self._inv_mass_qm.reshape((-1, 1))
+
+        # Cache for polaritonic state energies; refreshed each step in run
+        self._energies_cache = np.zeros(self.pol.pst)
+
+        # Work buffer for conjugated coefficients in the EDC correction
+        self._c_conj = np.zeros(self.pol.pst, dtype=np.complex128)
+
+        # Precompiled printf-style formats for per-state output lines
+        self._prob_fmt = "%15.8f" * self.pol.pst
+        self._acc_fmt = "%12.5f (%d->%d)" * self.pol.pst
+
+        # Persistent output file handles; opened lazily in the writers
+        self._fh_shstate = None
+        self._fh_shprob = None
+        self._fh_dotpopnacd = None
+
         # Debug variables
         self.dotpopnac_d = np.zeros(self.pol.pst)
 
-        # Initialize event to print
-        self.event = {"HOP": []}
+        # Initialize event to print; a deque is drained in print_step without
+        # reallocating the container every step
+        self.event = {"HOP": deque()}
 
     def run(self, qed, qm, mm=None, output_dir="./", l_save_qed_log=False, l_save_qm_log=False, \
         l_save_mm_log=False, l_save_scr=True, restart=None):
@@ -115,8 +179,14 @@ class SH(MQC_QED):
         qm.calc_tdp_grad = False
         if (qed.force_level == "full"):
             qm.calc_tdp_grad = True
+        l_do_mm = (self.pol.l_qmmm and mm != None)
         self.print_init(qed, qm, mm, restart)
 
+        # Pre-draw the uniform random numbers consumed by hop_check; seeding
+        # from the current random state keeps seeded runs reproducible
+        self._rands = np.random.default_rng(random.getrandbits(32)).random(self.nsteps + 1)
+        self._rand_ind = 0
+
         if (restart == None):
             # Calculate initial input geometry at t = 0.0 s
             self.istep = -1
@@ -124,7 +194,7 @@ class SH(MQC_QED):
             self.pol.reset_qed(qm.calc_coupling)
 
             qm.get_data(self.pol, base_dir, bo_list, self.dt, self.istep, calc_force_only=False)
-            if (self.pol.l_qmmm and mm != None):
+            if (l_do_mm):
                 mm.get_data(self.pol, base_dir, bo_list, self.istep, calc_force_only=False)
             if (not self.pol.l_nacme):
                 self.pol.get_nacme()
@@ -133,6 +203,8 @@ class SH(MQC_QED):
             if (not self.pol.l_pnacme):
                 self.pol.get_pnacme()
             qed.transform(self.pol, mode="a2d")
+            self._energies_cache = np.fromiter((states.energy for states in self.pol.pol_states), \
+                dtype=np.float64, count=self.pol.pst)
 
             self.hop_prob(qed)
             self.hop_check(pol_list)
@@ -149,7 +221,7 @@ class SH(MQC_QED):
                     qed.transform(self.pol, mode="a2d")
 
             if (self.l_hop):
-                if (self.pol.l_qmmm and mm != None):
+                if (l_do_mm):
                     mm.get_data(self.pol, base_dir, bo_list, self.istep, calc_force_only=True)
                 qed.get_data(self.pol, base_dir, pol_list, self.dt, self.istep, calc_force_only=True)
 
@@ -170,6 +242,10 @@ class SH(MQC_QED):
 
         self.istep += 1
 
+        restart_file = os.path.join(base_dir, "RESTART.bin")
+        restart_pool = ThreadPoolExecutor(max_workers=1)
+        restart_future = None
+
         # Main MD loop
         for istep in range(self.istep, self.nsteps):
 
@@ -182,7 +258,7 @@ class SH(MQC_QED):
             self.pol.reset_qed(qm.calc_coupling)
 
             qm.get_data(self.pol, base_dir, bo_list, self.dt, istep, calc_force_only=False)
-            if (self.pol.l_qmmm and mm != None):
+            if (l_do_mm):
                 mm.get_data(self.pol, base_dir, bo_list, istep, calc_force_only=False)
 
             if (not self.pol.l_nacme and self.l_adj_nac):
@@ -190,6 +266,8 @@ class SH(MQC_QED):
             if (self.l_adj_tdp):
                 self.pol.adjust_tdp()
             qed.get_data(self.pol, base_dir, pol_list, self.dt, istep, calc_force_only=False)
+            self._energies_cache = np.fromiter((states.energy for states in self.pol.pol_states), \
+                dtype=np.float64, count=self.pol.pst)
 
             self.calculate_force()
             self.cl_update_velocity()
@@ -219,7 +297,7 @@ class SH(MQC_QED):
                     qed.transform(self.pol, mode="a2d")
 
             if (self.l_hop):
-                if (self.pol.l_qmmm and mm != None):
+                if (l_do_mm):
                     mm.get_data(self.pol, base_dir, bo_list, istep, calc_force_only=True)
                 qed.get_data(self.pol, base_dir, pol_list, self.dt, istep, calc_force_only=True)
 
@@ -236,9 +314,26 @@ class SH(MQC_QED):
                 self.write_final_xyz(unixmd_dir, istep)
 
             self.fstep = istep
-            restart_file = os.path.join(base_dir, "RESTART.bin")
-            with open(restart_file, 'wb') as f:
-                pickle.dump({'qed':qed, 'qm':qm, 'md':self}, f)
+            if ((istep + 1) % self.restart_freq == 0 or istep == self.nsteps - 1):
+                # Serialize in the main thread for a consistent snapshot; the
+                # background worker writes the restart file atomically. Check
+                # the previous write so a failure is not silently discarded
+                if (restart_future != None):
+                    restart_future.result()
+                data = pickle.dumps({'qed':qed, 'qm':qm, 'md':self}, protocol=pickle.HIGHEST_PROTOCOL)
+                restart_future = restart_pool.submit(_write_restart, restart_file, data)
+
+        if (restart_future != None):
+            restart_future.result()
+        restart_pool.shutdown(wait=True)
+
+        # Close persistent output files
+        for fh in [self._fh_shstate, self._fh_shprob, self._fh_dotpopnacd]:
+            if (fh != None):
+                fh.close()
+        self._fh_shstate = None
+        self._fh_shprob = None
+        self._fh_dotpopnacd = None
 
         # Delete scratch directory
         if (not l_save_scr):
@@ -250,7 +345,7 @@ class SH(MQC_QED):
             if (os.path.exists(tmp_dir)):
                 shutil.rmtree(tmp_dir)
 
-            if (self.pol.l_qmmm and mm != None):
+            if (l_do_mm):
                 tmp_dir = os.path.join(unixmd_dir, "scr_mm")
                 if (os.path.exists(tmp_dir)):
                     shutil.rmtree(tmp_dir)
@@ -263,42 +358,27 @@ class SH(MQC_QED):
         # Reset surface hopping variables
         self.rstate_old = self.rstate
 
-        self.prob = np.zeros(self.pol.pst)
-        self.acc_prob = np.zeros(self.pol.pst + 1)
+        # The probability buffers are allocated once in __init__
+        self.prob.fill(0.)
 
         self.l_hop = False
 
-        accum = 0.
-
-        # tmp_ham = U^+ * H * U
-        tmp_ham = np.zeros((self.pol.pst, self.pol.pst)) 
-        tmp_ham = np.matmul(np.transpose(qed.unitary), np.matmul(qed.ham_d, qed.unitary))
-        # self.pol.pnacme = U^+ * K * U + U^+ * U_dot
-        # H and K are Hamiltonian and NACME in uncoupled basis
-
         if (not qed.l_trivial):
-            for ist in range(self.pol.pst):
-                if (ist != self.rstate):
-                    self.prob[ist] = - 2. * (self.pol.rho_a.imag[self.rstate, ist] * tmp_ham[self.rstate, ist] \
-                        - self.pol.rho_a.real[self.rstate, ist] * self.pol.pnacme[self.rstate, ist]) \
-                        * self.dt / self.pol.rho_a.real[self.rstate, self.rstate]
-
-                    if (self.prob[ist] < 0.):
-                        self.prob[ist] = 0.
-                    accum += self.prob[ist]
-                self.acc_prob[ist + 1] = accum
-            psum = self.acc_prob[self.pol.pst]
+            # Only the running-state row of tmp_ham = U^+ * H * U enters the
+            # probabilities, so two mat-vec products replace the full
+            # transform; the unitary is real in the current QED models
+            # self.pol.pnacme = U^+ * K * U + U^+ * U_dot
+            # H and K are Hamiltonian and NACME in uncoupled basis
+            ham_row = np.dot(np.dot(qed.unitary[:, self.rstate], qed.ham_d), qed.unitary)
+            rho_row = self.pol.rho_a[self.rstate]
+            _hop_prob_kernel(rho_row.real, rho_row.imag, ham_row, self.pol.pnacme[self.rstate], \
+                self.dt, self.rstate, self.prob)
         else:
-            for ist in range(self.pol.pst):
-                if (ist != self.rstate):
-                    if (ist == qed.trivial_state):
-                        self.prob[ist] = 1.
-                    else:
-                        self.prob[ist] = 0.
+            if (qed.trivial_state != self.rstate):
+                self.prob[qed.trivial_state] = 1.
 
-                    accum += self.prob[ist]
-                self.acc_prob[ist + 1] = accum
-            psum = self.acc_prob[self.pol.pst]
+        np.cumsum(self.prob, out=self.acc_prob[1:])
+        psum = self.acc_prob[self.pol.pst]
 
         if (psum > 1.):
             self.prob /= psum
@@ -309,14 +389,16 @@ class SH(MQC_QED):
 
             :param integer,list pol_list: List of polaritonic states for QED calculation
         """
-        self.rand = random.random()
-        for ist in range(self.pol.pst):
-            if (ist == self.rstate):
-                continue
-            if (self.rand > self.acc_prob[ist] and self.rand <= self.acc_prob[ist + 1]):
-                self.l_hop = True
-                self.rstate = ist
-                pol_list[0] = self.rstate
+        self.rand = float(self._rands[self._rand_ind])
+        self._rand_ind += 1
+        # Since acc_prob is monotonically non-decreasing, the hopping state is
+        # found with a single binary search; acc_prob[ist] < rand <= acc_prob[ist + 1]
+        # The interval for the running state has zero width, hence it is never chosen
+        ist = int(np.searchsorted(self.acc_prob, self.rand, side="left")) - 1
+        if (0 <= ist < self.pol.pst and ist != self.rstate and self.acc_prob[ist + 1] > self.acc_prob[ist]):
+            self.l_hop = True
+            self.rstate = ist
+            pol_list[0] = self.rstate
 
     def evaluate_hop(self, qed, pol_list):
         """ Routine to evaluate hopping and velocity rescaling
@@ -333,20 +415,25 @@ class SH(MQC_QED):
                 a = 1.
                 b = 1.
                 det = 1.
-                if (self.hop_rescale == "velocity"):
-                    a = np.sum(self.pol.mass[0:self.pol.nat_qm] * np.sum(self.pol.pnac[self.rstate_old, self.rstate] ** 2., axis=1))
-                    b = 2. * np.sum(self.pol.mass[0:self.pol.nat_qm] * np.sum(self.pol.pnac[self.rstate_old, self.rstate] \
-                        * self.pol.vel[0:self.pol.nat_qm], axis=1))
-                    c = 2. * pot_diff
-                    det = b ** 2. - 4. * a * c
-                elif (self.hop_rescale == "momentum"):
-                    a = np.sum(1. / self.pol.mass[0:self.pol.nat_qm] * np.sum(self.pol.pnac[self.rstate_old, self.rstate] ** 2., axis=1))
-                    b = 2. * np.sum(np.sum(self.pol.pnac[self.rstate_old, self.rstate] * self.pol.vel[0:self.pol.nat_qm], axis=1))
-                    c = 2. * pot_diff
-                    det = b ** 2. - 4. * a * c
-                elif (self.hop_rescale == "augment"):
-                    a = np.sum(1. / self.pol.mass[0:self.pol.nat_qm] * np.sum(self.pol.pnac[self.rstate_old, self.rstate] ** 2., axis=1))
-                    b = 2. * np.sum(np.sum(self.pol.pnac[self.rstate_old, self.rstate] * self.pol.vel[0:self.pol.nat_qm], axis=1))
+                # When the kinetic energy already rules the hop out and the
+                # rejected hop keeps the velocity, the quadratic coefficients
+                # are never used; skip the coupling reductions. The augment
+                # scheme is excluded since it rescales even on rejection
+                l_skip_quad = (self.hop_reject == "keep" and self.hop_rescale != "augment" and \
+                    self.pol.ekin_qm < pot_diff)
+                if (not l_skip_quad and self.hop_rescale in ["velocity", "momentum", "augment"]):
+                    # The reductions over the coupling vector are common to all
+                    # methods; compute them once and let each branch pick the
+                    # mass weighting
+                    pnac_pair = self.pol.pnac[self.rstate_old, self.rstate]
+                    pnac2_per_atom = np.einsum('ij,ij->i', pnac_pair, pnac_pair)
+                    pnacv_per_atom = np.einsum('ij,ij->i', pnac_pair, self.pol.vel[0:self.pol.nat_qm])
+                    if (self.hop_rescale == "velocity"):
+                        a = np.dot(self._mass_qm, pnac2_per_atom)
+                        b = 2. * np.dot(self._mass_qm, pnacv_per_atom)
+                    else:
+                        a = np.dot(self._inv_mass_qm, pnac2_per_atom)
+                        b = 2. * np.sum(pnacv_per_atom)
                     c = 2. * pot_diff
                     det = b ** 2. - 4. * a * c
 
@@ -385,12 +472,12 @@ class SH(MQC_QED):
                     if (self.hop_rescale == "energy" or (det < 0. and self.hop_rescale == "augment")):
                         if (det < 0.):
                             self.event["HOP"].append("Accept hopping: no solution to find rescale factor, but velocity is simply rescaled")
-                        x = np.sqrt(1. - pot_diff / self.pol.ekin_qm)
+                        x = math.sqrt(1. - pot_diff / self.pol.ekin_qm)
                     else:
                         if (b < 0.):
-                            x = 0.5 * (- b - np.sqrt(det)) / a
+                            x = 0.5 * (- b - math.sqrt(det)) / a
                         else:
-                            x = 0.5 * (- b + np.sqrt(det)) / a
+                            x = 0.5 * (- b + math.sqrt(det)) / a
 
                 # Rescale velocities for QM atoms
                 if (not (self.hop_reject == "keep" and self.l_reject)):
@@ -401,13 +488,13 @@ class SH(MQC_QED):
                         self.pol.vel[0:self.pol.nat_qm] += x * self.pol.pnac[self.rstate_old, self.rstate]
 
                     elif (self.hop_rescale == "momentum"):
-                        self.pol.vel[0:self.pol.nat_qm] += x * self.pol.pnac[self.rstate_old, self.rstate] / \
-                            self.pol.mass[0:self.pol.nat_qm].reshape((-1, 1))
+                        self.pol.vel[0:self.pol.nat_qm] += (x * self._inv_mass_col_qm) * \
+                            self.pol.pnac[self.rstate_old, self.rstate]
 
                     elif (self.hop_rescale == "augment"):
                         if (det > 0. or self.pol.ekin_qm < pot_diff):
-                            self.pol.vel[0:self.pol.nat_qm] += x * self.pol.pnac[self.rstate_old, self.rstate] / \
-                                self.pol.mass[0:self.pol.nat_qm].reshape((-1, 1))
+                            self.pol.vel[0:self.pol.nat_qm] += (x * self._inv_mass_col_qm) * \
+                                self.pol.pnac[self.rstate_old, self.rstate]
                         else:
                             self.pol.vel[0:self.pol.nat_qm] *= x
 
@@ -429,32 +516,36 @@ class SH(MQC_QED):
                 states.coef_a = 0. + 0.j
             self.pol.pol_states[self.rstate].coef_a = 1. + 0.j
 
-        self.pol.rho_a = np.zeros((self.pol.pst, self.pol.pst), dtype=np.complex128)
+        self.pol.rho_a.fill(0.)
         self.pol.rho_a[self.rstate, self.rstate] = 1. + 0.j
 
     def correct_dec_edc(self):
         """ Routine to decoherence correction, energy-based decoherence correction(EDC) scheme
         """
-        # Save exp(-dt/tau) instead of tau itself
-        exp_tau = np.array([1. if (ist == self.rstate) else np.exp(- self.dt / ((1. + self.edc_parameter / self.pol.ekin_qm) / \
-            np.abs(self.pol.pol_states[ist].energy - self.pol.pol_states[self.rstate].energy))) for ist in range(self.pol.pst)])
-        rho_update = 1.
+        # Save exp(-dt/tau) instead of tau itself; the denominator does not
+        # depend on the state, so it is folded into a single scalar factor
+        energies = self._energies_cache
+        scale = - self.dt / (1. + self.edc_parameter / self.pol.ekin_qm)
+        exp_tau = np.exp(scale * np.abs(energies - energies[self.rstate]))
+        exp_tau[self.rstate] = 1.
 
         if (self.elec_object == "coefficient"):
-            # Update coefficients
-            for ist in range(self.pol.pst):
-                # self.pol.pol_states[self.rstate] need other updated coefficients
-                if (ist != self.rstate):
-                    self.pol.pol_states[ist].coef_a *= exp_tau[ist]
-                    rho_update -= self.pol.pol_states[ist].coef_a.conjugate() * self.pol.pol_states[ist].coef_a
-
-            self.pol.pol_states[self.rstate].coef_a *= np.sqrt(rho_update / self.pol.rho_a[self.rstate, self.rstate])
-
-            # Get density matrix elements from coefficients
+            # Update coefficients; the running state keeps its coefficient
+            # since exp_tau is one there
+            coef = np.fromiter((states.coef_a for states in self.pol.pol_states), \
+                dtype=np.complex128, count=self.pol.pst)
+            coef *= exp_tau
+            rho_update = 1. - np.sum(coef.conjugate() * coef) \
+                + coef[self.rstate].conjugate() * coef[self.rstate]
+
+            coef[self.rstate] *= np.sqrt(rho_update / self.pol.rho_a[self.rstate, self.rstate])
+
+            # Rebuild the density matrix in place as an outer product, which
+            # keeps it Hermitian by construction
+            np.conjugate(coef, out=self._c_conj)
+            np.multiply.outer(self._c_conj, coef, out=self.pol.rho_a)
             for ist in range(self.pol.pst):
-                for jst in range(ist, self.pol.pst):
-                    self.pol.rho_a[ist, jst] = self.pol.pol_states[ist].coef_a.conjugate() * self.pol.pol_states[jst].coef_a
-                    self.pol.rho_a[jst, ist] = self.pol.rho_a[ist, jst].conjugate()
+                self.pol.pol_states[ist].coef_a = coef[ist]
 
 #        elif (self.elec_object == "density"):
 #            # save old running state element for update running state involved elements
@@ -478,14 +569,14 @@ class SH(MQC_QED):
     def calculate_force(self):
         """ Routine to calculate the forces
         """
-        self.rforce = np.copy(self.pol.pol_states[self.rstate].force)
+        np.copyto(self.rforce, self.pol.pol_states[self.rstate].force)
 
     def update_energy(self):
         """ Routine to update the energy of molecules in surface hopping dynamics
         """
         # Update kinetic energy
         self.pol.update_kinetic()
-        self.pol.epot = self.pol.pol_states[self.rstate].energy
+        self.pol.epot = self._energies_cache[self.rstate]
         self.pol.etot = self.pol.epot + self.pol.ekin
 
     def write_md_output(self, unixmd_dir, istep):
@@ -509,13 +600,20 @@ class SH(MQC_QED):
             :param string unixmd_dir: PyUNIxMD directory
             :param integer istep: Current MD step
         """
+        # Keep the files open across steps instead of reopening them per line
+        if (self._fh_shstate == None):
+            self._fh_shstate = open(os.path.join(unixmd_dir, "SHSTATE"), "a")
+            self._fh_shprob = open(os.path.join(unixmd_dir, "SHPROB"), "a")
+
         # Write SHSTATE file
-        tmp = f'{istep + 1:9d}{"":14s}{self.rstate}'
-        typewriter(tmp, unixmd_dir, "SHSTATE", "a")
+        self._fh_shstate.write(f'{istep + 1:9d}{"":14s}{self.rstate}\n')
 
         # Write SHPROB file
-        tmp = f'{istep + 1:9d}' + "".join([f'{self.prob[ist]:15.8f}' for ist in range(self.pol.pst)])
-        typewriter(tmp, unixmd_dir, "SHPROB", "a")
+        self._fh_shprob.write(f'{istep + 1:9d}' + self._prob_fmt % tuple(self.prob) + "\n")
+
+        # Flush on the output cadence so the files never lag the checkpoint
+        self._fh_shstate.flush()
+        self._fh_shprob.flush()
 
     def write_dotpop(self, unixmd_dir, istep):
         """ Write time-derivative BO population
@@ -525,8 +623,20 @@ class SH(MQC_QED):
         """
         # Write NAC term in DOTPOPNACD
         if (self.verbosity >= 1):
-            tmp = f'{istep + 1:9d}' + "".join([f'{pop:15.8f}' for pop in self.dotpopnac_d])
-            typewriter(tmp, unixmd_dir, "DOTPOPNACD", "a")
+            if (self._fh_dotpopnacd == None):
+                self._fh_dotpopnacd = open(os.path.join(unixmd_dir, "DOTPOPNACD"), "a")
+            self._fh_dotpopnacd.write(f'{istep + 1:9d}' + \
+                self._prob_fmt % tuple(self.dotpopnac_d) + "\n")
+            self._fh_dotpopnacd.flush()
+
+    def __getstate__(self):
+        """ Exclude open file handles when the object is pickled for restart
+        """
+        state = self.__dict__.copy()
+        state["_fh_shstate"] = None
+        state["_fh_shprob"] = None
+        state["_fh_dotpopnacd"] = None
+        return state
 
     def print_init(self, qed, qm, mm, restart):
         """ Routine to print the initial information of dynamics
@@ -577,17 +687,16 @@ class SH(MQC_QED):
 
         # Print DEBUG1 for each step
         if (self.verbosity >= 1):
-            DEBUG1 = f" DEBUG1{istep + 1:>7d}"
-            DEBUG1 += f"{self.rand:11.5f}"
+            acc_args = []
             for ist in range(self.pol.pst):
-                DEBUG1 += f"{self.acc_prob[ist]:12.5f} ({self.rstate}->{ist})"
+                acc_args += (self.acc_prob[ist], self.rstate, ist)
+            DEBUG1 = f" DEBUG1{istep + 1:>7d}{self.rand:11.5f}" + self._acc_fmt % tuple(acc_args)
             print (DEBUG1, flush=True)
 
         # Print event in surface hopping
         for category, events in self.event.items():
-            if (len(events) != 0):
-                for ievent in events:
-                    print (f" {category}{istep + 1:>9d}  {ievent}", flush=True)
-        self.event["HOP"] = []
+            while (len(events) != 0):
+                ievent = events.popleft()
+                print (f" {category}{istep + 1:>9d}  {ievent}", flush=True)
 
 
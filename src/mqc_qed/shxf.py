@@ -329,7 +329,7 @@ class SHXF(MQC_QED):
 
         # tmp_ham = U^+ * H * U
         tmp_ham = np.zeros((self.pol.pst, self.pol.pst)) 
-        tmp_ham = np.matmul(np.transpose(qed.unitary), np.matmul(qed.ham_d, qed.unitary))
+        tmp_ham = np.matmul(qed.unitary.T, np.matmul(qed.ham_d, qed.unitary))
         # self.pol.pnacme = U^+ * K * U + U^+ * U_dot
         # H and K are Hamiltonian and NACME in uncoupled basis
 
@@ -341,11 +341,13 @@ class Polariton(object):
     def update_kinetic(self):
         """ Get kinetic energy
         """
-        self.ekin = np.sum(0.5 * self.mass * np.sum(self.vel ** 2, axis=1))
+        # Single contraction avoids the squared-velocity temporaries
+        self.ekin = 0.5 * np.einsum('i,ij,ij->', self.mass, self.vel, self.vel)
 
         if (self.l_qmmm):
             # Calculate the kinetic energy for QM atoms
-            self.ekin_qm = np.sum(0.5 * self.mass[0:self.nat_qm] * np.sum(self.vel[0:self.nat_qm] ** 2, axis=1))
+            self.ekin_qm = 0.5 * np.einsum('i,ij,ij->', self.mass[0:self.nat_qm], \
+                self.vel[0:self.nat_qm], self.vel[0:self.nat_qm])
         else:
             self.ekin_qm = self.ekin
 
@@ -177,7 +177,7 @@ class Jaynes_Cummings(QED_calculator):
         # Temporary matrix to be used to check the phase of unitary matrix
         if (istep >= 0):
             tmp_mat = np.zeros((polariton.pst, polariton.pst)) 
-            tmp_mat = np.matmul(np.transpose(self.unitary_old), self.unitary)
+            tmp_mat = np.matmul(self.unitary_old.T, self.unitary)
             for ist in range(polariton.pst):
                 for jst in range(polariton.pst):
                     tmp_val = round(tmp_mat[ist, jst] ** 2.)
@@ -223,7 +223,7 @@ class Jaynes_Cummings(QED_calculator):
 
         # Calculate the character of diabatic states at current step
         # self.cur_d_ind is used to check the switching of adjacent two states
-        self.cur_d_ind = np.transpose(np.matmul(np.transpose(self.get_d_ind), self.permut))
+        self.cur_d_ind = np.matmul(self.get_d_ind.T, self.permut).T
 
         # Write 'index_AD.dat' file; diabatic character for each polaritonic state
         cur_d_ind_row = ""
@@ -469,8 +469,8 @@ class Jaynes_Cummings(QED_calculator):
                     tmp_nacme[ist, jst] = polariton.nacme[ind_mol1, ind_mol2]
                     tmp_nacme[jst, ist] = - tmp_nacme[ist, jst]
 
-        polariton.pnacme += np.matmul(np.transpose(self.unitary), np.matmul(tmp_nacme, self.unitary))
-        polariton.pnacme += np.matmul(np.transpose(self.unitary), self.unitary_dot)
+        polariton.pnacme += np.matmul(self.unitary.T, np.matmul(tmp_nacme, self.unitary))
+        polariton.pnacme += np.matmul(self.unitary.T, self.unitary_dot)
 
     def backup_qed(self):
         """ Backup Hamiltonian matrix, unitary matrix and polaritonic state energies